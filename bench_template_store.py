@@ -0,0 +1,218 @@
+# bench_template_store.py - Benchmark do armazém compartilhado de gabaritos
+#
+# Simula `uvicorn --workers N`: cada worker publica parte dos gabaritos (como se
+# tivesse atendido o /generate_gabarito) e depois corrige provas de gabaritos
+# aleatórios, inclusive os gerados pelos OUTROS workers. Mede os acertos de cache
+# entre workers (shared_hits), a latência de busca do mapa e a memória de cada
+# processo, comparando com o caminho antigo (json.load a cada correção).
+# Os bboxes são cópias privadas de cada worker (poucos KB, limitadas pelo LRU);
+# o que é compartilhado sem cópia é a camada estática (<id>_layer.npy, mmap).
+# Por isso, no fim, todos os workers mapeiam e leem as camadas de todos os
+# gabaritos AO MESMO TEMPO e o PSS de arquivo (smaps_rollup) é medido: somado
+# entre os workers, ele fica perto de gabaritos x tamanho da camada, enquanto o
+# RSS de arquivo somado fica perto de gabaritos x workers x tamanho.
+# Antes de medir, confere que o caminho rápido (compute_fill_ratios +
+# score_fill_ratios) dá exatamente o mesmo resultado que
+# grade_with_precise_positions no mapa de exemplo.
+#
+# Exemplo: python bench_template_store.py --workers 4 --templates 200 --requests 2000
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from grade_it import compute_fill_ratios, grade_with_precise_positions, score_fill_ratios
+from template_store import TemplateStore, bboxes_from_position_data, question_numbers_from_position_data
+
+SAMPLE_MAP = os.path.join("templates", "7327e376-60bc-456c-9019-602f60390baa_positions.json")
+SAMPLE_PNG = os.path.join("templates", "7327e376-60bc-456c-9019-602f60390baa.png")
+
+
+def _rss_kb():
+    """RSS do processo em kB, separando páginas anônimas das mapeadas de arquivo."""
+    rss = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(("VmRSS", "RssAnon", "RssFile")):
+                    key, value = line.split(":")
+                    rss[key] = int(value.split()[0])
+    except OSError:
+        import resource
+        rss["VmRSS"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss
+
+
+def _pss_kb():
+    """RSS/PSS do processo em kB; PSS divide cada página compartilhada entre quem a mapeia."""
+    pss = {}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss", "Pss_Anon", "Pss_File"):
+                    pss[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return pss
+
+
+def verify_fast_path(trials=20, threshold=0.2):
+    """Corrige as mesmas imagens binárias pelos dois caminhos e compara tudo."""
+    with open(SAMPLE_MAP, "r") as f:
+        position_data = json.load(f)
+    bubble_positions = position_data["bubble_positions"]
+    bboxes = bboxes_from_position_data(position_data)
+    questions = question_numbers_from_position_data(position_data)
+    choices = tuple(position_data["choices"])
+    page_w, page_h = position_data["page_size"]
+    rng = np.random.default_rng(0)
+
+    for trial in range(trials):
+        # Densidades variadas para cobrir folhas em branco, marcadas e com múltiplas marcações
+        density = rng.uniform(0.0, 0.5)
+        binary = (rng.random((page_h, page_w)) < density).astype(np.uint8) * 255
+        expected = [rng.choice(list(choices)) for _ in bubble_positions]
+
+        reference = grade_with_precise_positions(binary, bubble_positions, expected, threshold)
+        fast = score_fill_ratios(compute_fill_ratios(binary, bboxes), choices, expected, threshold, questions)
+
+        for key in ("total_score", "max_score", "percentage", "multiple_answers", "unanswered"):
+            assert reference[key] == fast[key], f"{key} difere na tentativa {trial}: {reference[key]} != {fast[key]}"
+        for ref_q, fast_q in zip(reference["question_results"], fast["question_results"]):
+            for key in ("question", "student_answer", "correct_answer", "is_correct"):
+                assert ref_q[key] == fast_q[key], f"Q{ref_q['question']} {key} difere na tentativa {trial}"
+            for choice, ratio in ref_q["bubble_status"].items():
+                assert float(ratio) == fast_q["bubble_status"][choice], \
+                    f"Q{ref_q['question']} {choice}: {ratio} != {fast_q['bubble_status'][choice]}"
+    return trials
+
+
+def _worker(worker_id, args, root, barrier, results):
+    with open(SAMPLE_MAP, "r") as f:
+        position_data = json.load(f)
+
+    store = TemplateStore(root)
+    template_ids = [f"bench-{i:05d}" for i in range(args.templates)]
+
+    # Fase 1: este worker "gera" a sua fatia dos gabaritos
+    for template_id in template_ids[worker_id::args.workers]:
+        store.publish(template_id, position_data, SAMPLE_PNG)
+        if args.mode == "json":
+            with open(os.path.join(root, f"{template_id}_positions.json"), "w") as f:
+                json.dump(position_data, f)
+    barrier.wait()
+
+    # Fase 2: correções em gabaritos aleatórios (de qualquer worker)
+    page_w, page_h = position_data["page_size"]
+    binary = (np.random.default_rng(worker_id).random((page_h, page_w)) > 0.7).astype(np.uint8) * 255
+    rng = random.Random(worker_id)
+    lookup_times = []
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        template_id = rng.choice(template_ids)
+        t0 = time.perf_counter()
+        if args.mode == "json":
+            with open(os.path.join(root, f"{template_id}_positions.json"), "r") as f:
+                bboxes = [[b["bbox"] for b in q["bubbles"]] for q in json.load(f)["bubble_positions"]]
+        else:
+            bboxes = store.get(template_id).bboxes
+        lookup_times.append(time.perf_counter() - t0)
+        compute_fill_ratios(binary, bboxes)
+    elapsed = time.perf_counter() - start
+
+    # Fase 3: todos os workers mapeiam e leem todas as camadas simultaneamente
+    layer_memory = {}
+    if args.mode == "store":
+        barrier.wait()
+        layers = [store.get(template_id).load_layer() for template_id in template_ids]
+        layer_bytes = sum(layer.nbytes for layer in layers if layer is not None)
+        for layer in layers:
+            if layer is not None:
+                int(np.asarray(layer).sum())  # toca todas as páginas
+        barrier.wait()
+        layer_memory = {"layers_mapped": sum(layer is not None for layer in layers),
+                        "layer_bytes": layer_bytes, **_pss_kb(), **_rss_kb()}
+        barrier.wait()
+        del layers
+
+    results.put({
+        "worker": worker_id,
+        "stats": dict(store.stats),
+        "requests_per_sec": args.requests / elapsed,
+        "lookup_mean_us": 1e6 * sum(lookup_times) / len(lookup_times),
+        "lookup_p95_us": 1e6 * sorted(lookup_times)[int(0.95 * (len(lookup_times) - 1))],
+        "rss_kb": _rss_kb(),
+        "layer_memory_kb": layer_memory,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do armazém compartilhado de gabaritos")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--templates", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000, help="correções por worker")
+    parser.add_argument("--mode", choices=("store", "json"), default="store")
+    parser.add_argument("--output", help="salva o resumo em JSON")
+    args = parser.parse_args()
+
+    print(f"Caminho rápido idêntico ao grade_with_precise_positions em {verify_fast_path()} imagens")
+
+    root = tempfile.mkdtemp(prefix="testify_store_")
+    try:
+        barrier = mp.Barrier(args.workers)
+        results = mp.Queue()
+        procs = [mp.Process(target=_worker, args=(i, args, root, barrier, results)) for i in range(args.workers)]
+        for p in procs:
+            p.start()
+        per_worker = sorted((results.get() for _ in procs), key=lambda r: r["worker"])
+        for p in procs:
+            p.join()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    totals = {key: sum(r["stats"][key] for r in per_worker) for key in ("local_hits", "shared_hits", "misses")}
+    summary = {
+        "mode": args.mode,
+        "workers": args.workers,
+        "templates": args.templates,
+        "requests_per_worker": args.requests,
+        "cache": totals,
+        "cross_worker_hit_rate": totals["shared_hits"] / max(1, sum(totals.values())),
+        "requests_per_sec": sum(r["requests_per_sec"] for r in per_worker),
+        "per_worker": per_worker,
+    }
+
+    print(f"Modo: {args.mode} | workers: {args.workers} | gabaritos: {args.templates}")
+    print(f"Cache: local={totals['local_hits']} entre workers={totals['shared_hits']} falhas={totals['misses']}")
+    print(f"Correções/s (total): {summary['requests_per_sec']:.0f}")
+    layer_memory = [r["layer_memory_kb"] for r in per_worker if r["layer_memory_kb"]]
+    if layer_memory:
+        layer_kb = layer_memory[0]["layer_bytes"] // 1024
+        summary["layer_sharing"] = {
+            "layer_kb_per_worker": layer_kb,
+            "sum_rss_file_kb": sum(m.get("RssFile", 0) for m in layer_memory),
+            "sum_pss_file_kb": sum(m.get("Pss_File", 0) for m in layer_memory),
+        }
+        print(f"Camadas: {layer_memory[0]['layers_mapped']} x {args.workers} workers ({layer_kb} kB por worker) | "
+              f"RSS de arquivo somado {summary['layer_sharing']['sum_rss_file_kb']} kB | "
+              f"PSS de arquivo somado {summary['layer_sharing']['sum_pss_file_kb']} kB")
+    for r in per_worker:
+        rss = r["rss_kb"]
+        print(f"  worker {r['worker']}: busca média {r['lookup_mean_us']:.1f} µs (p95 {r['lookup_p95_us']:.1f} µs), "
+              f"RSS {rss.get('VmRSS', 0)} kB (anon {rss.get('RssAnon', '?')}, arquivo {rss.get('RssFile', '?')})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
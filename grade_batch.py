@@ -0,0 +1,337 @@
+# grade_batch.py - Correção offline em lote (pastas ou arquivos multipágina de scanner)
+#
+# Uso:
+#   python -m grade_batch ENTRADA --map templates/<id>_positions.json \
+#       --respostas '["A","B","C",...]' --output resultados.csv
+#
+# ENTRADA pode ser uma pasta (percorrida recursivamente), uma imagem, um TIFF
+# multipágina ou um PDF (requer PyMuPDF). As páginas são enumeradas como um
+# fluxo e corrigidas em paralelo com grade_gabarito_improved, em todos os
+# núcleos; cada worker lê o JSON do mapa uma única vez e monta os arrays em
+# memória (TemplateEntry.from_position_data), sem gravar nada na pasta do mapa.
+#
+# Os resultados são gravados de forma incremental (CSV linha a linha ou Parquet
+# em partes) e cada página corrigida com sucesso é registrada no checkpoint
+# (<saída>.checkpoint): se a execução for interrompida, rodar o mesmo comando
+# de novo continua de onde parou. Páginas com erro (ex.: um TIFF que o scanner
+# ainda estava gravando) não entram no checkpoint e são tentadas de novo.
+# Uma página pode aparecer mais de uma vez na saída durante a execução
+# (erro seguido de nova tentativa, ou queda entre gravar a linha e o
+# checkpoint); ao terminar, a saída é compactada e fica só a última linha de
+# cada page_id.
+# Se um arquivo não puder nem ser aberto para contar as páginas (ex.: PDF sem
+# PyMuPDF instalado, ou corrompido), ele vira uma linha de erro em vez de parar
+# a execução.
+
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from grade_it import grade_gabarito_improved
+from template_store import TemplateEntry, template_id_from_map_path
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".pdf")
+RESULT_FIELDS = [
+    "page_id", "source", "page", "total_score", "max_score", "percentage",
+    "multiple_answers", "unanswered", "answers", "error",
+]
+# Tipos fixos da saída Parquet (sem isso, uma parte só com erros teria colunas do tipo null)
+PARQUET_TYPES = {
+    "page_id": "string", "source": "string", "page": "int64", "total_score": "int64",
+    "max_score": "int64", "percentage": "double", "multiple_answers": "int64",
+    "unanswered": "int64", "answers": "string", "error": "string",
+}
+
+# Estado de cada processo do pool (preenchido uma vez em _init_worker)
+_worker_state = {}
+
+
+def _import_fitz():
+    try:
+        import fitz  # PyMuPDF
+    except ImportError:
+        raise ImportError("PDF requer PyMuPDF: pip install pymupdf") from None
+    return fitz
+
+
+def _count_pages(path):
+    """Número de páginas de um arquivo (1 para imagens simples)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".tif", ".tiff"):
+        return max(1, cv2.imcount(path))
+    if ext == ".pdf":
+        fitz = _import_fitz()
+        with fitz.open(path) as doc:
+            return doc.page_count
+    return 1
+
+
+def iter_pages(input_path):
+    """Gera (page_id, caminho, índice da página) sem carregar nenhuma imagem."""
+    if os.path.isdir(input_path):
+        for dirpath, dirnames, filenames in os.walk(input_path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield from iter_pages(os.path.join(dirpath, name))
+        return
+
+    # Roda na thread que alimenta o pool: uma exceção aqui travaria a execução.
+    # Se não der para contar as páginas, envia só a primeira; o worker vai falhar
+    # ao abri-la e devolver uma linha de erro para o arquivo.
+    try:
+        page_count = _count_pages(input_path)
+    except Exception:
+        page_count = 1
+    for page in range(page_count):
+        yield f"{input_path}#{page + 1}", input_path, page
+
+
+def load_page(path, page, dpi=150):
+    """Decodifica uma única página como imagem BGR."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".tif", ".tiff"):
+        ok, mats = cv2.imreadmulti(path, start=page, count=1, flags=cv2.IMREAD_COLOR)
+        if not ok or not mats:
+            raise ValueError(f"Could not load page {page + 1} from {path}")
+        return mats[0]
+    if ext == ".pdf":
+        fitz = _import_fitz()
+        # Mantém o último PDF aberto: as páginas de um mesmo arquivo costumam vir juntas
+        if _worker_state.get("pdf_path") != path:
+            if _worker_state.get("pdf_doc") is not None:
+                _worker_state["pdf_doc"].close()
+            _worker_state["pdf_doc"] = fitz.open(path)
+            _worker_state["pdf_path"] = path
+        pix = _worker_state["pdf_doc"][page].get_pixmap(dpi=dpi)
+        img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+        return cv2.cvtColor(img, cv2.COLOR_RGBA2BGR if pix.n == 4 else cv2.COLOR_RGB2BGR)
+    img = cv2.imread(path)
+    if img is None:
+        raise ValueError(f"Could not load image from {path}")
+    return img
+
+
+def _init_worker(map_path, expected_answers, threshold, dpi):
+    # Só em memória: o lote não grava arrays na pasta do mapa, que é do usuário
+    with open(map_path, "r") as f:
+        position_data = json.load(f)
+    _worker_state["template"] = TemplateEntry.from_position_data(template_id_from_map_path(map_path), position_data)
+    _worker_state["expected_answers"] = expected_answers
+    _worker_state["threshold"] = threshold
+    _worker_state["dpi"] = dpi
+
+
+def _grade_page(task):
+    page_id, path, page = task
+    row = {"page_id": page_id, "source": path, "page": page + 1}
+    try:
+        img = load_page(path, page, _worker_state["dpi"])
+        results = grade_gabarito_improved(
+            image_path=img,
+            expected_answers=_worker_state["expected_answers"],
+            template=_worker_state["template"],
+            threshold=_worker_state["threshold"],
+        )
+        row.update({
+            "total_score": results["total_score"],
+            "max_score": results["max_score"],
+            "percentage": round(results["percentage"], 2),
+            "multiple_answers": results["multiple_answers"],
+            "unanswered": results["unanswered"],
+            # Uma letra por questão; '*' = múltiplas marcações, '-' = em branco
+            "answers": "".join(
+                {"MULTI": "*", "NONE": "-"}.get(r["student_answer"], r["student_answer"])
+                for r in results["question_results"]
+            ),
+            "error": "",
+        })
+    except Exception as e:
+        row["error"] = str(e)
+    return row
+
+
+def _last_row_per_page(rows):
+    """Remove linhas repetidas de uma mesma página, mantendo a mais recente."""
+    latest = {}
+    for row in rows:
+        latest.pop(row["page_id"], None)
+        latest[row["page_id"]] = row
+    return list(latest.values())
+
+
+class CsvResultWriter:
+    """Acrescenta linhas ao CSV; cada linha é gravada em disco antes do checkpoint.
+
+    write() e close() devolvem as linhas que já estão em disco.
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        new_file = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self._file = open(output_path, "a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=RESULT_FIELDS)
+        if new_file:
+            self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+        return [row]
+
+    def close(self):
+        self._file.close()
+
+        with open(self.output_path, "r", newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        unique_rows = _last_row_per_page(rows)
+        if len(unique_rows) != len(rows):
+            tmp_path = f"{self.output_path}.tmp"
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+                writer.writeheader()
+                writer.writerows(unique_rows)
+            os.replace(tmp_path, self.output_path)
+        return []
+
+
+class ParquetResultWriter:
+    """Grava partes Parquet a cada `flush_every` linhas e junta tudo no final."""
+
+    def __init__(self, output_path, flush_every=200):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit("Saída Parquet requer pyarrow: pip install pyarrow")
+        self.output_path = output_path
+        self.parts_dir = f"{output_path}.parts"
+        self.flush_every = flush_every
+        self._rows = []
+        os.makedirs(self.parts_dir, exist_ok=True)
+
+    @staticmethod
+    def _schema():
+        import pyarrow as pa
+        return pa.schema([(field, pa.type_for_alias(PARQUET_TYPES[field])) for field in RESULT_FIELDS])
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not self._rows:
+            return []
+        part_index = len(os.listdir(self.parts_dir))
+        part_path = os.path.join(self.parts_dir, f"part-{part_index:05d}.parquet")
+        table = pa.Table.from_pylist(self._rows, schema=self._schema())
+        pq.write_table(table, f"{part_path}.tmp")
+        os.replace(f"{part_path}.tmp", part_path)
+        done, self._rows = self._rows, []
+        return done
+
+    def write(self, row):
+        self._rows.append({field: row.get(field) for field in RESULT_FIELDS})
+        return self._flush() if len(self._rows) >= self.flush_every else []
+
+    def close(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        done = self._flush()
+        parts = sorted(
+            os.path.join(self.parts_dir, name)
+            for name in os.listdir(self.parts_dir) if name.endswith(".parquet")
+        )
+        if parts:
+            schema = self._schema()
+            table = pa.concat_tables([pq.read_table(p).cast(schema) for p in parts])
+            rows = _last_row_per_page(table.to_pylist())
+            pq.write_table(pa.Table.from_pylist(rows, schema=schema), self.output_path)
+        return done
+
+
+def _load_expected_answers(value):
+    # Aceita a lista JSON direto (como no /corrigir_prova) ou @arquivo.json
+    if value.startswith("@"):
+        with open(value[1:], "r") as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+def _checkpoint(checkpoint, committed_rows):
+    # Só páginas corrigidas com sucesso: as que deram erro são tentadas de novo ao retomar
+    page_ids = [row["page_id"] for row in committed_rows if not row["error"]]
+    if page_ids:
+        checkpoint.write("".join(f"{page_id}\n" for page_id in page_ids))
+        checkpoint.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m grade_batch", description="Correção em lote de gabaritos escaneados")
+    parser.add_argument("input", help="pasta, imagem, TIFF multipágina ou PDF")
+    parser.add_argument("--map", required=True, help="mapa de posições (templates/<id>_positions.json)")
+    parser.add_argument("--respostas", required=True, help="lista JSON de respostas ou @arquivo.json")
+    parser.add_argument("--output", required=True, help="arquivo de saída (.csv ou .parquet)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--dpi", type=int, default=150, help="resolução para renderizar páginas de PDF")
+    parser.add_argument("--chunksize", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    expected_answers = _load_expected_answers(args.respostas)
+
+    # Falha cedo, antes de iniciar os workers: mapa ilegível ou PDF sem PyMuPDF
+    with open(args.map, "r") as f:
+        TemplateEntry.from_position_data(template_id_from_map_path(args.map), json.load(f))
+    if os.path.isfile(args.input) and args.input.lower().endswith(".pdf"):
+        try:
+            _import_fitz()
+        except ImportError as e:
+            raise SystemExit(str(e))
+
+    checkpoint_path = f"{args.output}.checkpoint"
+    done_ids = set()
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            done_ids = {line.rstrip("\n") for line in f if line.strip()}
+        print(f"Retomando: {len(done_ids)} páginas já corrigidas", file=sys.stderr)
+
+    if args.output.lower().endswith(".parquet"):
+        writer = ParquetResultWriter(args.output)
+    else:
+        writer = CsvResultWriter(args.output)
+
+    tasks = (task for task in iter_pages(args.input) if task[0] not in done_ids)
+
+    graded = errors = 0
+    start = last_report = time.perf_counter()
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, mp.Pool(
+        args.workers,
+        initializer=_init_worker,
+        initargs=(args.map, expected_answers, args.threshold, args.dpi),
+    ) as pool:
+        try:
+            for row in pool.imap_unordered(_grade_page, tasks, chunksize=args.chunksize):
+                graded += 1
+                errors += bool(row["error"])
+                _checkpoint(checkpoint, writer.write(row))
+
+                now = time.perf_counter()
+                if now - last_report >= 1.0:
+                    last_report = now
+                    print(f"\r{graded} páginas | {graded / (now - start):.1f} páginas/s | {errors} erros",
+                          end="", file=sys.stderr, flush=True)
+        finally:
+            _checkpoint(checkpoint, writer.close())
+
+    elapsed = time.perf_counter() - start
+    print(f"\r{graded} páginas em {elapsed:.1f}s ({graded / elapsed if elapsed else 0:.1f} páginas/s), "
+          f"{errors} erros -> {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
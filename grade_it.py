@@ -60,48 +60,8 @@ def grade_with_precise_positions(binary_img, bubble_positions, expected_answers,
             'bubble_status': bubble_status
         })
         
-        # Debug mode
-        if debug and debug_img is not None:
-            correct_answer = expected_answers[q_num-1]
-            
-            for bubble in bubbles:
-                choice = bubble['choice']
-                center_x, center_y = bubble['center']
-                filled_ratio = bubble_status[choice]
-                
-                # Determine colors based on answer status
-                if choice == correct_answer and choice == student_answer:
-                    color = (0, 255, 0)  # Green
-                    status_text = "CORRECT"
-                elif choice == correct_answer and student_answer not in ['MULTI', 'NONE']:
-                    color = (255, 0, 0)  # Blue
-                    status_text = "SHOULD BE"
-                elif choice == student_answer and not is_correct and student_answer not in ['MULTI', 'NONE']:
-                    color = (0, 0, 255)  # Red
-                    status_text = "WRONG"
-                elif filled_ratio > threshold:
-                    color = (0, 165, 255)  # Orange
-                    status_text = "MULTI"
-                else:
-                    color = (128, 128, 128)  # Gray
-                    status_text = "empty"
-                
-                cv2.circle(debug_img, (center_x, center_y), 20, color, 3)
-                
-                cv2.putText(debug_img, f"{filled_ratio:.2f}", 
-                           (center_x-25, center_y-25), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
-                cv2.putText(debug_img, status_text, 
-                           (center_x-25, center_y+35), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
-            
-            # Summary
-            question_pos = q_data.get('question_pos', (bubbles[0]['center'][0] - 100, bubbles[0]['center'][1]))
-            summary_color = (0, 255, 0) if is_correct else (0, 0, 255)
-            summary_text = f"Q{q_num}: Student={student_answer}, Correct={correct_answer} ({'✓' if is_correct else '✗'})"
-            cv2.putText(debug_img, summary_text, 
-                       (int(question_pos[0]), int(question_pos[1]) - 10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, summary_color, 2)
-    
     if debug and debug_img is not None:
+        draw_grading_overlay(debug_img, bubble_positions, question_results, threshold)
         print("Grading visualization:")
         print("- GREEN: Correctly marked answer")
         print("- BLUE: Correct answer (should have been marked)")
@@ -122,18 +82,152 @@ def grade_with_precise_positions(binary_img, bubble_positions, expected_answers,
         'unanswered': len([r for r in question_results if r['student_answer'] == 'NONE'])
     }
 
+def draw_grading_overlay(debug_img, bubble_positions, question_results, threshold, scale=1.0):
+    """
+    Draw the colored grading overlay (in place) on a BGR image.
+    Positions are in template coordinates; `scale` maps them onto debug_img.
+    """
+    # Thumbnails only get the colored circles: the text would be unreadable
+    draw_text = scale >= 0.5
+    radius = max(2, int(round(20 * scale)))
+    thickness = max(1, int(round(3 * scale)))
+    summary_thickness = max(1, int(round(2 * scale)))
+
+    def to_img(point):
+        return (int(round(point[0] * scale)), int(round(point[1] * scale)))
+
+    def offset(pixels):
+        return int(round(pixels * scale))
+
+    for q_data, result in zip(bubble_positions, question_results):
+        bubbles = q_data['bubbles']
+        q_num = result['question']
+        student_answer = result['student_answer']
+        correct_answer = result['correct_answer']
+        is_correct = result['is_correct']
+
+        for bubble in bubbles:
+            choice = bubble['choice']
+            center_x, center_y = to_img(bubble['center'])
+            filled_ratio = result['bubble_status'][choice]
+
+            # Determine colors based on answer status
+            if choice == correct_answer and choice == student_answer:
+                color = (0, 255, 0)  # Green
+                status_text = "CORRECT"
+            elif choice == correct_answer and student_answer not in ['MULTI', 'NONE']:
+                color = (255, 0, 0)  # Blue
+                status_text = "SHOULD BE"
+            elif choice == student_answer and not is_correct and student_answer not in ['MULTI', 'NONE']:
+                color = (0, 0, 255)  # Red
+                status_text = "WRONG"
+            elif filled_ratio > threshold:
+                color = (0, 165, 255)  # Orange
+                status_text = "MULTI"
+            else:
+                color = (128, 128, 128)  # Gray
+                status_text = "empty"
+
+            cv2.circle(debug_img, (center_x, center_y), radius, color, thickness)
+
+            if draw_text:
+                cv2.putText(debug_img, f"{filled_ratio:.2f}",
+                           (center_x-offset(25), center_y-offset(25)), cv2.FONT_HERSHEY_SIMPLEX, 0.4 * scale, color, 1)
+                cv2.putText(debug_img, status_text,
+                           (center_x-offset(25), center_y+offset(35)), cv2.FONT_HERSHEY_SIMPLEX, 0.4 * scale, color, 1)
+
+        # Summary
+        if draw_text:
+            question_pos = to_img(q_data.get('question_pos', (bubbles[0]['center'][0] - 100, bubbles[0]['center'][1])))
+            summary_color = (0, 255, 0) if is_correct else (0, 0, 255)
+            summary_text = f"Q{q_num}: Student={student_answer}, Correct={correct_answer} ({'✓' if is_correct else '✗'})"
+            cv2.putText(debug_img, summary_text,
+                       (question_pos[0], question_pos[1] - offset(10)),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5 * scale, summary_color, summary_thickness)
+
+    return debug_img
+
+def compute_fill_ratios(binary_img, bboxes):
+    """
+    Fill ratio of every bubble at once, from an (questions, choices, 4) bbox array.
+    Uses an integral image, so the cost does not depend on the bubble size.
+    """
+    height, width = binary_img.shape[:2]
+    integral = cv2.integral((binary_img > 0).astype(np.uint8))
+
+    boxes = np.asarray(bboxes, dtype=np.int64)
+    x1 = np.clip(boxes[..., 0], 0, width)
+    y1 = np.clip(boxes[..., 1], 0, height)
+    x2 = np.clip(boxes[..., 2], 0, width)
+    y2 = np.clip(boxes[..., 3], 0, height)
+    x2 = np.maximum(x1, x2)
+    y2 = np.maximum(y1, y2)
+
+    filled = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+    area = (x2 - x1) * (y2 - y1)
+    return np.divide(filled, area, out=np.zeros(area.shape, dtype=np.float64), where=area > 0)
+
+def score_fill_ratios(fill_ratios, choices, expected_answers, threshold, question_numbers=None):
+    """
+    Same result format as grade_with_precise_positions, from a fill-ratio matrix.
+    `question_numbers` gives the map's 'question' field for each row (default 1..N).
+    """
+    question_results = []
+    score = 0
+
+    if question_numbers is None:
+        question_numbers = range(1, len(fill_ratios) + 1)
+
+    for q_num, row in zip(question_numbers, fill_ratios.tolist()):
+        bubble_status = dict(zip(choices, row))
+        marked_choices = [choice for choice, ratio in bubble_status.items() if ratio > threshold]
+
+        if len(marked_choices) == 1:
+            student_answer = marked_choices[0]
+            is_correct = (student_answer == expected_answers[q_num-1])
+            if is_correct:
+                score += 1
+        else:
+            student_answer = "MULTI" if len(marked_choices) > 1 else "NONE"
+            is_correct = False
+
+        question_results.append({
+            'question': q_num,
+            'student_answer': student_answer,
+            'correct_answer': expected_answers[q_num-1],
+            'is_correct': is_correct,
+            'bubble_status': bubble_status
+        })
+
+    return {
+        'total_score': score,
+        'max_score': len(question_results),
+        'percentage': (score / len(question_results)) * 100,
+        'question_results': question_results,
+        'multiple_answers': len([r for r in question_results if r['student_answer'] == 'MULTI']),
+        'unanswered': len([r for r in question_results if r['student_answer'] == 'NONE'])
+    }
+
 def grade_gabarito_improved(
     image_path,
     expected_answers,
     position_data=None,
     choices=("A", "B", "C", "D", "E"),
     threshold=0.2,
-    debug=False
+    debug=False,
+    template=None,
+    review_record=None
 ):
     """
-    Grade improved answer sheets with header labels
+    Grade improved answer sheets with header labels.
+    `image_path` may also be an already decoded BGR image (numpy array).
+    `template` is a TemplateEntry from template_store (shared, memory-mapped);
+    when given it replaces position_data.
+    `review_record`, if a dict, is filled with the compact per-sheet record
+    (registration transform + fill-ratio matrix) used by review_store to
+    render the overlay later, without keeping the image.
     """
-    img = cv2.imread(image_path)
+    img = image_path if isinstance(image_path, np.ndarray) else cv2.imread(image_path)
     if img is None:
         raise ValueError(f"Could not load image from {image_path}")
     
@@ -155,6 +249,22 @@ def grade_gabarito_improved(
         cv2.waitKey(0)
         cv2.destroyAllWindows()
     
+    if template is not None:
+        if not debug:
+            fill_ratios = compute_fill_ratios(binary, template.bboxes)
+            if review_record is not None:
+                # No registration step yet: the sheet is read in template coordinates
+                review_record.update({
+                    'transform': np.eye(3),
+                    'fill_ratios': fill_ratios,
+                    'image_size': (binary.shape[1], binary.shape[0]),
+                    'expected_answers': list(expected_answers),
+                    'threshold': threshold,
+                })
+            return score_fill_ratios(fill_ratios, template.choices, expected_answers, threshold,
+                                     template.questions)
+        position_data = {'bubble_positions': template.bubble_positions()}
+
     if position_data is None:
         print("Warning: No position data provided. You need to generate position data first.")
         return None
@@ -0,0 +1,466 @@
+# loadtest.py - Teste de carga concorrente dos endpoints /generate_gabarito e /corrigir_prova
+#
+# Exemplos:
+#   python loadtest.py --in-process                       # app ASGI no próprio processo
+#   python loadtest.py --spawn --workers 4                # sobe um uvicorn local e mede cada worker
+#   python loadtest.py --url http://127.0.0.1:8000 --server-pid 1234
+#
+# Mistura de cenários (pesos em --mix): gabarito em branco, gabarito com
+# respostas, correções com uploads em várias resoluções e rajadas de correção
+# (um professor enviando a turma inteira, uma folha atrás da outra; tamanhos em
+# --batch-sizes). Cada nível de concorrência em --concurrency roda por
+# --duration segundos. O resultado (vazão, latências p50/p95/p99, taxa de erro,
+# CPU/RSS por worker) é salvo em JSON em loadtest_results/ para acompanhar a
+# capacidade ao longo do tempo.
+#
+# O resumo "overall" é por requisição HTTP (cada folha de uma rajada conta como
+# uma requisição, com a sua própria latência). Em "scenarios", cada amostra é
+# uma execução do cenário: na rajada, a turma inteira; a latência por folha da
+# rajada fica em scenarios.burst.per_request. Entre os processos filhos do
+# servidor, só os workers do uvicorn são marcados como "worker"; os demais (ex.:
+# o resource_tracker do multiprocessing) aparecem como "helper".
+#
+# Com --spawn e --in-process o servidor roda num diretório temporário (os
+# gabaritos, mapas e registros de revisão gerados não vão para o templates/ do
+# repositório) que é apagado no final, a menos que se use --keep-files.
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from PIL import Image, ImageDraw
+
+QUESTION_COUNTS = (10, 20, 30, 50)
+UPLOAD_RESOLUTIONS = ((620, 438), (1240, 877), (2480, 1754))
+DEFAULT_MIX = "gen_blank=2,gen_key=1,grade=6,burst=1"
+DEFAULT_BATCH_SIZES = "10,30"
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+# --- Métricas de processo (Linux, via /proc) ---
+
+def _child_pids(pid):
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children", "r") as f:
+                children += [int(c) for c in f.read().split()]
+    except OSError:
+        return []
+    return children + [grandchild for child in children for grandchild in _child_pids(child)]
+
+
+def _proc_role(pid, root_pid):
+    """'main' para o processo raiz, 'worker' para os workers do uvicorn, 'helper' para o resto."""
+    if pid == root_pid:
+        return "main"
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+    except OSError:
+        return "helper"
+    # uvicorn --workers sobe cada worker com multiprocessing (spawn_main); o
+    # resource_tracker também é um filho, mas não atende requisições
+    return "worker" if "spawn_main" in cmdline else "helper"
+
+
+def _proc_sample(pid):
+    """(segundos de CPU, RSS em kB) de um processo, ou None se não existir mais."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status", "r") as f:
+            rss = next((int(line.split()[1]) for line in f if line.startswith("VmRSS")), 0)
+    except (OSError, IndexError):
+        return None
+    # utime e stime são os campos 14 e 15 de /proc/<pid>/stat (11 e 12 depois do ')')
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK, rss
+
+
+class ProcessMonitor:
+    """Amostra CPU e RSS do servidor e de cada worker filho durante um nível de carga."""
+
+    def __init__(self, root_pid, interval=0.5):
+        self.root_pid = root_pid
+        self.interval = interval
+        self._start = {}
+        self._last = {}
+        self._max_rss = {}
+        self._roles = {}
+
+    def _pids(self):
+        return [self.root_pid] + _child_pids(self.root_pid)
+
+    def _sample(self):
+        for pid in self._pids():
+            sample = _proc_sample(pid)
+            if sample is None:
+                continue
+            if pid not in self._roles:
+                self._roles[pid] = _proc_role(pid, self.root_pid)
+            self._start.setdefault(pid, sample)
+            self._last[pid] = sample
+            self._max_rss[pid] = max(self._max_rss.get(pid, 0), sample[1])
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            self._sample()
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+        self._sample()
+
+    def report(self, elapsed):
+        workers = []
+        for pid, (cpu_end, rss) in self._last.items():
+            cpu = cpu_end - self._start[pid][0]
+            workers.append({
+                "pid": pid,
+                "role": self._roles[pid],
+                "cpu_seconds": round(cpu, 3),
+                "cpu_percent": round(100 * cpu / elapsed, 1) if elapsed else 0.0,
+                "rss_kb": rss,
+                "max_rss_kb": self._max_rss[pid],
+            })
+        return workers
+
+
+# --- Preparação dos payloads ---
+
+def _fill_sheet(png_bytes, map_path):
+    """Marca uma resposta aleatória por questão, se o mapa estiver acessível localmente."""
+    img = Image.open(io.BytesIO(png_bytes)).convert("RGB")
+    if os.path.exists(map_path):
+        with open(map_path, "r") as f:
+            position_data = json.load(f)
+        draw = ImageDraw.Draw(img)
+        for q_data in position_data["bubble_positions"]:
+            draw.ellipse(list(random.choice(q_data["bubbles"])["bbox"]), fill="black")
+    return img
+
+
+async def prepare_uploads(client, workdir):
+    """Gera um gabarito em branco por tamanho e prepara uploads em várias resoluções."""
+    uploads = []
+    for num_questions in QUESTION_COUNTS:
+        response = await client.post("/generate_gabarito", json={
+            "tituloProva": f"Carga {num_questions}", "numQuestoes": num_questions,
+        })
+        response.raise_for_status()
+        map_path = response.headers["X-Map-Path"]
+        # map_path é relativo ao diretório de trabalho do servidor
+        sheet = _fill_sheet(response.content, os.path.join(workdir, map_path) if workdir else map_path)
+        respostas = json.dumps([random.choice("ABCDE") for _ in range(num_questions)])
+        for width, height in UPLOAD_RESOLUTIONS:
+            buffer = io.BytesIO()
+            sheet.resize((width, height)).save(buffer, "JPEG", quality=90)
+            uploads.append({
+                "label": f"{num_questions}q@{width}x{height}",
+                "map_path": map_path,
+                "respostas": respostas,
+                "image": buffer.getvalue(),
+            })
+    return uploads
+
+
+# --- Cenários ---
+
+async def scenario_gen_blank(client, context):
+    num_questions = random.choice(QUESTION_COUNTS)
+    return await client.post("/generate_gabarito", json={
+        "tituloProva": "Carga", "numQuestoes": num_questions,
+    }), f"{num_questions}q"
+
+
+async def scenario_gen_key(client, context):
+    num_questions = random.choice(QUESTION_COUNTS)
+    return await client.post("/generate_gabarito", json={
+        "tituloProva": "Carga", "numQuestoes": num_questions,
+        "respostas": [random.choice("ABCDE") for _ in range(num_questions)],
+    }), f"{num_questions}q"
+
+
+async def _post_grade(client, upload):
+    return await client.post(
+        "/corrigir_prova",
+        files={"file": ("prova.jpg", upload["image"], "image/jpeg")},
+        data={"map_path": upload["map_path"], "respostas": upload["respostas"]},
+    )
+
+
+async def scenario_grade(client, context):
+    upload = random.choice(context["uploads"])
+    return await _post_grade(client, upload), upload["label"]
+
+
+async def scenario_burst(client, context):
+    # Uma turma inteira da mesma prova, enviada em sequência pelo mesmo professor.
+    # Devolve (resposta, latência) de cada folha, para o resumo por requisição.
+    size = random.choice(context["batch_sizes"])
+    upload = random.choice(context["uploads"])
+    timed = []
+    for _ in range(size):
+        t0 = time.perf_counter()
+        response = await _post_grade(client, upload)
+        timed.append((response, time.perf_counter() - t0))
+    return timed, f"{size} folhas"
+
+
+SCENARIOS = {
+    "gen_blank": scenario_gen_blank,
+    "gen_key": scenario_gen_key,
+    "grade": scenario_grade,
+    "burst": scenario_burst,
+}
+
+
+def _parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Cenário desconhecido: {name} (opções: {', '.join(SCENARIOS)})")
+        mix[name] = float(weight)
+    return mix
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _per_request(samples):
+    """Uma entrada por requisição HTTP, no formato das amostras, para _summarize()."""
+    return [
+        {"ok": not (isinstance(status, str) or status >= 400), "status": status,
+         "http_requests": 1, "latency": latency}
+        for s in samples for status, latency in s["requests"]
+    ]
+
+
+def _summarize(samples, elapsed):
+    latencies = sorted(s["latency"] for s in samples)
+    errors = sum(1 for s in samples if not s["ok"])
+    http_requests = sum(s["http_requests"] for s in samples)
+    latency_ms = {}
+    for name, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100)):
+        value = _percentile(latencies, q)
+        latency_ms[name] = None if value is None else round(1000 * value, 2)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+        # Difere de requests só nas rajadas, em que cada amostra é uma turma inteira
+        "http_requests": http_requests,
+        "http_throughput_rps": http_requests / elapsed if elapsed else 0.0,
+        "latency_ms": latency_ms,
+    }
+
+
+async def run_level(client, context, mix, concurrency, duration, monitor_pid):
+    """Roda um nível de concorrência por `duration` segundos e devolve o resumo."""
+    names, weights = list(mix), list(mix.values())
+    samples = []
+    deadline = time.perf_counter() + duration
+
+    async def user():
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                response, variant = await SCENARIOS[name](client, context)
+                latency = time.perf_counter() - t0
+                # Cenários de uma requisição devolvem a resposta; a rajada, (resposta, latência) por folha
+                timed = response if isinstance(response, list) else [(response, latency)]
+                requests = [(r.status_code, request_latency) for r, request_latency in timed]
+                failed = [status for status, _ in requests if status >= 400]
+                ok, status = not failed, failed[0] if failed else requests[0][0]
+            except httpx.HTTPError as e:
+                latency = time.perf_counter() - t0
+                ok, status, variant = False, type(e).__name__, None
+                requests = [(status, latency)]
+            samples.append({
+                "scenario": name, "variant": variant, "ok": ok, "status": status,
+                "http_requests": len(requests), "latency": latency, "requests": requests,
+            })
+
+    stop = asyncio.Event()
+    monitor = ProcessMonitor(monitor_pid) if monitor_pid and os.path.exists(f"/proc/{monitor_pid}") else None
+    monitor_task = asyncio.create_task(monitor.run(stop)) if monitor else None
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    if monitor_task:
+        await monitor_task
+
+    by_scenario = {}
+    for name in names:
+        scenario_samples = [s for s in samples if s["scenario"] == name]
+        by_scenario[name] = _summarize(scenario_samples, elapsed)
+        variants = sorted({s["variant"] for s in scenario_samples if s["variant"]})
+        by_scenario[name]["variants"] = {
+            v: _summarize([s for s in scenario_samples if s["variant"] == v], elapsed) for v in variants
+        }
+        if any(s["http_requests"] > 1 for s in scenario_samples):
+            by_scenario[name]["per_request"] = _summarize(_per_request(scenario_samples), elapsed)
+
+    requests = _per_request(samples)
+    status_counts = {}
+    for r in requests:
+        status_counts[str(r["status"])] = status_counts.get(str(r["status"]), 0) + 1
+
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "overall": _summarize(requests, elapsed),
+        "status_counts": status_counts,
+        "scenarios": by_scenario,
+        "processes": monitor.report(elapsed) if monitor else [],
+    }
+
+
+def _spawn_server(port, workers, workdir):
+    # Roda no diretório temporário, importando o app do repositório via PYTHONPATH
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_DIR, env.get("PYTHONPATH")]))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=workdir,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            if httpx.get(base_url + "/", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        if process.poll() is not None:
+            raise SystemExit("uvicorn terminou antes de ficar pronto")
+        time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("uvicorn não respondeu em 20s")
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=REPO_DIR, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main_async(args):
+    mix = _parse_mix(args.mix)
+    levels = [int(c) for c in args.concurrency.split(",")]
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+
+    server = None
+    original_cwd = os.getcwd()
+    # Arquivos gerados pelo servidor (gabaritos, mapas, revisões) ficam fora do repositório
+    workdir = tempfile.mkdtemp(prefix="testify_loadtest_") if (args.in_process or args.spawn) else None
+    try:
+        if args.in_process:
+            sys.path.insert(0, REPO_DIR)
+            os.chdir(workdir)
+            from main import app
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver",
+                                       timeout=args.timeout)
+            monitor_pid = os.getpid()
+            target = "in-process"
+        else:
+            if args.spawn:
+                server, base_url = _spawn_server(args.port, args.workers, workdir)
+                monitor_pid = server.pid
+            else:
+                base_url = args.url
+                monitor_pid = args.server_pid
+            client = httpx.AsyncClient(base_url=base_url, timeout=args.timeout,
+                                       limits=httpx.Limits(max_connections=max(levels)))
+            target = base_url
+
+        async with client:
+            context = {"uploads": await prepare_uploads(client, workdir), "batch_sizes": batch_sizes}
+            results = []
+            for concurrency in levels:
+                print(f"Concorrência {concurrency} por {args.duration}s...", file=sys.stderr)
+                level = await run_level(client, context, mix, concurrency, args.duration, monitor_pid)
+                overall = level["overall"]
+                print(f"  {overall['throughput_rps']:.1f} req/s | p50 {overall['latency_ms']['p50']} ms | "
+                      f"p95 {overall['latency_ms']['p95']} ms | p99 {overall['latency_ms']['p99']} ms | "
+                      f"erros {100 * overall['error_rate']:.1f}%", file=sys.stderr)
+                results.append(level)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+        os.chdir(original_cwd)
+        if workdir:
+            if args.keep_files:
+                print(f"Arquivos gerados mantidos em {workdir}", file=sys.stderr)
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git_commit(),
+        "target": target,
+        "workers": args.workers if args.spawn else None,
+        "mix": mix,
+        "batch_sizes": batch_sizes,
+        "host": {"python": platform.python_version(), "cpus": os.cpu_count(), "platform": platform.platform()},
+        "levels": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga dos endpoints do Testify")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://127.0.0.1:8000",
+                        help="servidor já em execução (os arquivos gerados ficam no servidor)")
+    target.add_argument("--spawn", action="store_true", help="sobe um uvicorn local para o teste")
+    target.add_argument("--in-process", action="store_true", help="usa o app ASGI no próprio processo")
+    parser.add_argument("--server-pid", type=int, help="PID do uvicorn (com --url) para medir CPU/RSS")
+    parser.add_argument("--workers", type=int, default=1, help="workers do uvicorn (com --spawn)")
+    parser.add_argument("--port", type=int, default=8765, help="porta do uvicorn (com --spawn)")
+    parser.add_argument("--concurrency", default="1,4,16", help="níveis de concorrência, separados por vírgula")
+    parser.add_argument("--duration", type=float, default=15.0, help="segundos por nível")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"pesos dos cenários (padrão: {DEFAULT_MIX})")
+    parser.add_argument("--batch-sizes", default=DEFAULT_BATCH_SIZES,
+                        help=f"folhas por rajada no cenário burst (padrão: {DEFAULT_BATCH_SIZES})")
+    parser.add_argument("--keep-files", action="store_true",
+                        help="não apaga o diretório temporário do servidor (com --spawn/--in-process)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="arquivo JSON (padrão: loadtest_results/<data>.json)")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(main_async(args))
+
+    output = args.output or os.path.join("loadtest_results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados salvos em {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 # main.py - VERSÃO COMPLETA (Revisão 8 - Layout Minimalista Refinado)
 
 # --- IMPORTAÇÕES ESSENCIAIS ---
-from fastapi import FastAPI, HTTPException, Response, File, UploadFile, Form #
+from fastapi import FastAPI, HTTPException, Response, File, UploadFile, Form, Query #
 from fastapi.responses import StreamingResponse, FileResponse #
 from pydantic import BaseModel, Field #
 from PIL import Image, ImageDraw, ImageFont # Pillow é importado como PIL
@@ -12,6 +12,13 @@ import uuid # Para gerar nomes de arquivo únicos
 import json # Para converter as respostas
 from gen_gabarito import generate_gabarito_png_improved
 from grade_it import grade_gabarito_improved # Importa o corretor
+from template_store import TemplateStore, template_id_from_map_path # Mapas compartilhados entre workers
+from review_store import ReviewStore, SheetNotFoundError # Imagens de revisão sob demanda
+
+# Armazém de gabaritos (arrays mmap em 'templates/', compartilhados por todos os workers)
+template_store = TemplateStore()
+# Registros compactos das folhas corrigidas (sobreposição renderizada só quando alguém abre)
+review_store = ReviewStore(template_store)
 
 # --- Novo fallback: gerar gabarito em branco (layout de bolhas) ---
 def generate_gabarito_em_branco(tituloProva: str, numQuestoes: int):
@@ -32,13 +39,16 @@ def generate_gabarito_em_branco(tituloProva: str, numQuestoes: int):
     try:
         # Chama a função importada do gen_gabarito.py
         # Ela salva o PNG e o JSON automaticamente
-        generate_gabarito_png_improved(
+        _, position_data = generate_gabarito_png_improved(
             filename=png_filename,
             num_questions=numQuestoes,
             title=tituloProva,
             subtitle=f"Nome: ________ Matrícula: ________ Turma: ________"
         )
 
+        # Publica o mapa e a camada estática para todos os workers
+        template_store.publish(file_basename, position_data, png_filename, json_filename)
+
         # Retorna os caminhos dos DOIS arquivos gerados
         return png_filename, json_filename
     except Exception as e:
@@ -49,6 +59,11 @@ def generate_gabarito_em_branco(tituloProva: str, numQuestoes: int):
 # --- Configuração do Servidor FastAPI ---
 app = FastAPI()
 
+# Retenção das revisões numa thread de fundo (fora do caminho da correção)
+@app.on_event("startup")
+def iniciar_retencao_revisoes():
+    review_store.start_pruning()
+
 # Modelo para validar os dados recebidos do App (Pydantic)
 class GabaritoRequest(BaseModel):
     tituloProva: str
@@ -227,7 +242,8 @@ async def corrigir_prova(
     respostas: str = Form(...)    # As respostas corretas (como string JSON)
 ):
     # Define um caminho temporário para salvar a imagem recebida
-    temp_image_path = os.path.join("templates", f"upload_{file.filename}")
+    # (uuid no nome: uploads simultâneos com o mesmo filename não podem se sobrescrever)
+    temp_image_path = os.path.join("templates", f"upload_{uuid.uuid4()}_{os.path.basename(file.filename or 'prova')}")
 
     try:
         # Garante que a pasta 'templates' exista
@@ -237,24 +253,31 @@ async def corrigir_prova(
         with open(temp_image_path, "wb") as buffer:
             buffer.write(await file.read())
 
-        # Carrega o "mapa" de posições
-        with open(map_path, 'r') as f:
-            position_data = json.load(f)
+        # Carrega o "mapa" de posições do armazém compartilhado (mmap, sem reler o JSON)
+        template_id = template_id_from_map_path(map_path)
+        template = template_store.get(template_id, positions_path=map_path)
 
         # Converte a string JSON de respostas em um array Python
         expected_answers = json.loads(respostas)
 
         # CHAMA O CORRETOR!
+        review_record = {}
         grade_results = grade_gabarito_improved(
             image_path=temp_image_path,
             expected_answers=expected_answers,
-            position_data=position_data,
-            debug=False # Desliga o debug (não queremos pop-ups no servidor)
+            template=template,
+            debug=False, # Desliga o debug (não queremos pop-ups no servidor)
+            review_record=review_record # Registro compacto para a revisão (GET /revisao/{sheet_id})
         )
 
         if grade_results is None:
             raise HTTPException(status_code=500, detail="Falha ao processar a correção")
 
+        # Guarda só a matriz de preenchimento + transformação; a imagem anotada é gerada sob demanda
+        sheet_id = review_store.new_sheet_id()
+        review_store.save(sheet_id, template_id, review_record)
+        grade_results['sheet_id'] = sheet_id
+
         # Retorna o JSON completo com os resultados da correção
         return grade_results
 
@@ -266,4 +289,26 @@ async def corrigir_prova(
     finally:
         # Limpa a imagem temporária
         if os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
\ No newline at end of file
+            os.remove(temp_image_path)
+
+# Imagem de revisão anotada de uma folha corrigida (renderizada só quando pedida, com cache)
+@app.get("/revisao/{sheet_id}")
+def revisao_prova(
+    sheet_id: str,
+    escala: float = Query(1.0, gt=0, le=1, description="1.0 = tamanho original; ex: 0.25 para miniatura")
+):
+    try:
+        png_bytes = review_store.render(sheet_id, escala)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="sheet_id inválido.")
+    except SheetNotFoundError:
+        raise HTTPException(status_code=404, detail="Folha corrigida não encontrada.")
+    except Exception as e:
+        print(f"Erro ao gerar revisão: {e}")
+        raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
+
+    return Response(
+        content=png_bytes,
+        media_type="image/png",
+        headers={"Content-Disposition": f'inline; filename="revisao_{sheet_id}.png"'}
+    )
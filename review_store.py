@@ -0,0 +1,259 @@
+# review_store.py - Imagens de revisão anotadas, renderizadas sob demanda
+#
+# Em vez do debug=True (cv2.imshow/waitKey, que trava o servidor), cada correção
+# guarda só um registro compacto da folha: a transformação de registro
+# (template -> imagem enviada) e a matriz de preenchimento (questões x opções).
+# Nada é desenhado durante a correção. Quando o professor abre uma folha, a
+# sobreposição colorida do grade_it.draw_grading_overlay é desenhada sobre a
+# camada estática do gabarito (mmap do template_store), na escala pedida, e o
+# PNG fica em cache em disco, compartilhado entre os workers.
+#
+# Arquivos em templates/reviews/:
+#   <sheet_id>.npz         -> registro compacto (alguns KB)
+#   <sheet_id>_<pct>.png   -> sobreposição renderizada em pct% do tamanho
+#
+# Retenção (aplicada por prune(), a cada PRUNE_INTERVAL_SECONDS, numa thread de
+# fundo iniciada por start_pruning() no startup do app; nunca no caminho da correção):
+# - registros vivem RECORD_TTL_SECONDS após a correção; depois disso a folha
+#   não pode mais ser revisada (404) e os PNGs dela também são apagados;
+# - PNGs em cache vivem CACHE_TTL_SECONDS desde o último acesso, e o total em
+#   cache é limitado a CACHE_MAX_BYTES (os menos acessados saem primeiro).
+
+import os
+import re
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+from grade_it import draw_grading_overlay, score_fill_ratios
+from template_store import TEMPLATES_DIR, TemplateStore, unique_tmp_path
+
+REVIEWS_DIR = os.path.join(TEMPLATES_DIR, "reviews")
+RECORD_TTL_SECONDS = 30 * 24 * 3600
+CACHE_TTL_SECONDS = 24 * 3600
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+PRUNE_INTERVAL_SECONDS = 600
+# Arquivos .tmp mais velhos que isso são restos de escritas interrompidas
+_STALE_TMP_SECONDS = 3600
+_SHEET_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_REVIEW_FILE_RE = re.compile(r"^([0-9a-f]{32})(?:\.npz|_\d+\.png)$")
+
+
+class SheetNotFoundError(LookupError):
+    """Não há registro para a folha (nunca corrigida ou já expirada)."""
+
+
+class ReviewStore:
+    """Registros compactos por folha corrigida + cache das sobreposições renderizadas.
+
+    Contrato:
+    - save(): grava o registro preenchido por grade_gabarito_improved(review_record=...)
+    - render(): devolve o PNG da sobreposição em `scale` (0 < scale <= 1)
+    - prune(): aplica a retenção (registros expirados, PNGs expirados ou acima do limite)
+    - start_pruning(): roda prune() a cada `prune_interval` numa thread de fundo
+    - erro: SheetNotFoundError se a folha não existir, ValueError se o id for inválido
+    """
+
+    def __init__(
+        self,
+        templates: TemplateStore,
+        root: str = REVIEWS_DIR,
+        record_ttl: float = RECORD_TTL_SECONDS,
+        cache_ttl: float = CACHE_TTL_SECONDS,
+        cache_max_bytes: int = CACHE_MAX_BYTES,
+        prune_interval: float = PRUNE_INTERVAL_SECONDS,
+    ):
+        self.templates = templates
+        self.root = root
+        self.record_ttl = record_ttl
+        self.cache_ttl = cache_ttl
+        self.cache_max_bytes = cache_max_bytes
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._pruner = None
+        self.stats = {"cache_hits": 0, "renders": 0, "pruned_records": 0, "pruned_images": 0}
+
+    @staticmethod
+    def new_sheet_id() -> str:
+        return uuid.uuid4().hex
+
+    def _record_path(self, sheet_id: str) -> str:
+        if not _SHEET_ID_RE.match(sheet_id):
+            raise ValueError(f"sheet_id inválido: {sheet_id}")
+        return os.path.join(self.root, f"{sheet_id}.npz")
+
+    def save(self, sheet_id: str, template_id: str, review_record):
+        """Grava o registro compacto de uma folha (escrita atômica)."""
+        os.makedirs(self.root, exist_ok=True)
+        path = self._record_path(sheet_id)
+        tmp_path = unique_tmp_path(path)
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                template_id=np.array(template_id),
+                transform=np.asarray(review_record["transform"], dtype=np.float64),
+                fill_ratios=np.asarray(review_record["fill_ratios"], dtype=np.float64),
+                image_size=np.asarray(review_record["image_size"], dtype=np.int32),
+                expected_answers=np.array([str(a) for a in review_record["expected_answers"]]),
+                threshold=np.array(review_record["threshold"], dtype=np.float64),
+            )
+        os.replace(tmp_path, path)
+
+    def load(self, sheet_id: str):
+        record_path = self._record_path(sheet_id)
+        try:
+            data = np.load(record_path)
+        except FileNotFoundError:
+            # Só a falta do registro vira "folha não encontrada"; outros arquivos
+            # ausentes (ex.: gabarito apagado) continuam sendo erros internos
+            raise SheetNotFoundError(sheet_id) from None
+        with data:
+            return {
+                "template_id": str(data["template_id"]),
+                "transform": data["transform"],
+                "fill_ratios": data["fill_ratios"],
+                "image_size": tuple(int(v) for v in data["image_size"]),
+                "expected_answers": data["expected_answers"].tolist(),
+                "threshold": float(data["threshold"]),
+            }
+
+    def render(self, sheet_id: str, scale: float = 1.0) -> bytes:
+        """PNG da sobreposição colorida; renderiza só na primeira vez para cada escala."""
+        percent = min(100, max(5, int(round(scale * 100))))
+        self._record_path(sheet_id)  # valida o id antes de montar qualquer caminho
+        cache_path = os.path.join(self.root, f"{sheet_id}_{percent}.png")
+
+        try:
+            with open(cache_path, "rb") as f:
+                png_bytes = f.read()
+        except FileNotFoundError:
+            png_bytes = None
+        if png_bytes is not None:
+            # mtime = último acesso: é o que a retenção usa para expirar/limitar o cache
+            try:
+                os.utime(cache_path)
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self.stats["cache_hits"] += 1
+            return png_bytes
+
+        png_bytes = self._render(self.load(sheet_id), percent / 100)
+
+        tmp_path = unique_tmp_path(cache_path)
+        with open(tmp_path, "wb") as f:
+            f.write(png_bytes)
+        os.replace(tmp_path, cache_path)
+        with self._lock:
+            self.stats["renders"] += 1
+        return png_bytes
+
+    def start_pruning(self) -> threading.Thread:
+        """Inicia (uma vez por processo) a thread que aplica a retenção periodicamente."""
+        with self._lock:
+            if self._pruner is not None and self._pruner.is_alive():
+                return self._pruner
+            self._pruner = threading.Thread(target=self._prune_loop, name="review-prune", daemon=True)
+            self._pruner.start()
+            return self._pruner
+
+    def _prune_loop(self):
+        while True:
+            try:
+                self.prune()
+            except Exception as e:
+                print(f"Erro ao aplicar a retenção das revisões: {e}")
+            time.sleep(self.prune_interval)
+
+    @staticmethod
+    def _remove(path) -> bool:
+        # Outro worker pode ter apagado o mesmo arquivo ao mesmo tempo
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def prune(self, now: float | None = None):
+        """Apaga registros expirados e mantém o cache de PNGs dentro do TTL e do limite de bytes."""
+        now = time.time() if now is None else now
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return
+
+        records, images = {}, []
+        for name in names:
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith(".tmp"):
+                if now - st.st_mtime > _STALE_TMP_SECONDS:
+                    self._remove(path)
+                continue
+            match = _REVIEW_FILE_RE.match(name)
+            if not match:
+                continue
+            if name.endswith(".npz"):
+                records[match.group(1)] = (path, st.st_mtime)
+            else:
+                images.append((st.st_mtime, st.st_size, path, match.group(1)))
+
+        expired = {sheet_id for sheet_id, (_, mtime) in records.items() if now - mtime > self.record_ttl}
+        pruned_records = sum(self._remove(records[sheet_id][0]) for sheet_id in expired)
+
+        pruned_images = 0
+        total_bytes = 0
+        for mtime, size, path, sheet_id in sorted(images, reverse=True):  # mais recentes primeiro
+            if sheet_id in expired or now - mtime > self.cache_ttl or total_bytes + size > self.cache_max_bytes:
+                pruned_images += self._remove(path)
+            else:
+                total_bytes += size
+
+        with self._lock:
+            self.stats["pruned_records"] += pruned_records
+            self.stats["pruned_images"] += pruned_images
+
+    def _render(self, record, scale):
+        template = self.templates.get(record["template_id"])
+        width, height = record["image_size"]
+        transform = record["transform"]
+
+        # Camada estática do gabarito, levada para o referencial da imagem corrigida
+        layer = template.load_layer()
+        if layer is not None:
+            base = cv2.cvtColor(np.asarray(layer), cv2.COLOR_GRAY2BGR)
+            del layer  # libera o mmap da camada
+        else:
+            page_w, page_h = template.page_size
+            base = np.full((page_h, page_w, 3), 255, dtype=np.uint8)
+        base = cv2.warpPerspective(base, transform, (width, height), borderValue=(255, 255, 255))
+
+        bubble_positions = template.bubble_positions()
+        centers = np.array(
+            [[bubble["center"] for bubble in q_data["bubbles"]] for q_data in bubble_positions],
+            dtype=np.float64,
+        ).reshape(-1, 1, 2)
+        mapped = cv2.perspectiveTransform(centers, transform).reshape(-1, 2).tolist()
+        for bubble, center in zip((b for q_data in bubble_positions for b in q_data["bubbles"]), mapped):
+            bubble["center"] = tuple(center)
+
+        if scale != 1.0:
+            base = cv2.resize(base, (max(1, int(width * scale)), max(1, int(height * scale))),
+                              interpolation=cv2.INTER_AREA)
+
+        results = score_fill_ratios(
+            record["fill_ratios"], template.choices, record["expected_answers"], record["threshold"],
+            template.questions
+        )
+        draw_grading_overlay(base, bubble_positions, results["question_results"], record["threshold"], scale)
+
+        ok, encoded = cv2.imencode(".png", base)
+        if not ok:
+            raise RuntimeError("Falha ao codificar a imagem de revisão")
+        return encoded.tobytes()
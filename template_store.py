@@ -0,0 +1,250 @@
+# template_store.py - Armazém compartilhado de gabaritos entre workers do uvicorn
+#
+# Com `uvicorn --workers N` cada processo tinha a sua própria cópia dos mapas de
+# posição (JSON -> listas de dicts) e só enxergava os arquivos gerados por ele.
+# Aqui os mapas viram arrays NumPy compactos gravados em `templates/`, visíveis
+# para todos os workers:
+# - os bboxes (poucos KB por gabarito) são cópias privadas de cada worker, lidas
+#   para a memória comum num cache LRU limitado (MAX_CACHED_TEMPLATES), sem
+#   manter nenhum arquivo aberto;
+# - a camada estática (~1 MB) é a única parte compartilhada sem cópia: só é
+#   aberta com mmap (np.load(..., mmap_mode='r')) quando uma revisão precisa
+#   dela, e todos os workers mapeiam as MESMAS páginas do page cache do kernel,
+#   então a memória das camadas cresce com o número de gabaritos e não com
+#   gabaritos x workers.
+#
+# Arquivos por gabarito (template_id = nome-base do PNG):
+#   <id>_positions.json  -> mapa original (continua sendo o contrato com o app)
+#   <id>_bboxes.npy      -> int32 (questões, opções, 4) com x1, y1, x2, y2
+#   <id>_layer.npy       -> uint8 (altura, largura) com a camada estática em cinza
+#   <id>_layout.json     -> metadados pequenos (opções, números das questões, tamanho
+#                           da página, mtime/tamanho do JSON de origem)
+#
+# Se o <id>_positions.json mudar depois de publicado (mtime ou tamanho
+# diferentes dos registrados no layout), os arrays são publicados de novo.
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+TEMPLATES_DIR = "templates"
+POSITIONS_SUFFIX = "_positions.json"
+MAX_CACHED_TEMPLATES = 1024
+
+
+def unique_tmp_path(path: str) -> str:
+    """Nome temporário exclusivo por processo E thread, para escrita atômica com os.replace."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def source_stamp(path: str | None) -> list[int] | None:
+    """[mtime_ns, tamanho] do JSON de origem, ou None se ele não existir."""
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def template_id_from_map_path(map_path: str) -> str:
+    """Extrai o template_id de um caminho como 'templates/<id>_positions.json'."""
+    name = os.path.basename(map_path)
+    if name.endswith(POSITIONS_SUFFIX):
+        name = name[: -len(POSITIONS_SUFFIX)]
+    elif name.endswith(".png"):
+        name = name[: -len(".png")]
+    if not name or name in (".", ".."):
+        raise ValueError(f"Caminho de mapa inválido: {map_path}")
+    return name
+
+
+def bboxes_from_position_data(position_data) -> np.ndarray:
+    """Converte 'bubble_positions' do JSON em um array int32 (questões, opções, 4)."""
+    bubble_positions = position_data["bubble_positions"]
+    bboxes = [[bubble["bbox"] for bubble in q_data["bubbles"]] for q_data in bubble_positions]
+    return np.asarray(bboxes, dtype=np.int32).reshape(len(bubble_positions), -1, 4)
+
+
+def question_numbers_from_position_data(position_data) -> list[int]:
+    """Números das questões na mesma ordem das linhas do array de bboxes."""
+    return [int(q_data["question"]) for q_data in position_data["bubble_positions"]]
+
+
+@dataclass(frozen=True)
+class TemplateEntry:
+    """Gabarito publicado no armazém (bboxes em memória, camada sob demanda)."""
+    template_id: str
+    bboxes: np.ndarray          # int32 (questões, opções, 4)
+    questions: tuple            # número de cada linha de bboxes (campo 'question' do mapa)
+    choices: tuple
+    page_size: tuple
+    layer_path: str
+    source: list | None = None  # source_stamp() do JSON usado na publicação
+
+    @classmethod
+    def from_position_data(cls, template_id: str, position_data) -> "TemplateEntry":
+        """Monta o gabarito só em memória, sem gravar nada (sem camada estática)."""
+        return cls(
+            template_id=template_id,
+            bboxes=bboxes_from_position_data(position_data),
+            questions=tuple(question_numbers_from_position_data(position_data)),
+            choices=tuple(position_data.get("choices", ("A", "B", "C", "D", "E"))),
+            page_size=tuple(position_data.get("page_size", ())),
+            layer_path="",
+        )
+
+    def load_layer(self) -> np.ndarray | None:
+        """Mapeia a camada estática (uint8, altura x largura) ou None se não houver PNG.
+
+        Não fica em cache: o mmap (e o descritor de arquivo) é liberado assim que
+        quem chamou descarta o array.
+        """
+        if not self.layer_path or not os.path.exists(self.layer_path):
+            return None
+        return np.load(self.layer_path, mmap_mode="r")
+
+    def bubble_positions(self):
+        """Reconstrói a lista de dicts no formato do JSON (usada no modo debug)."""
+        positions = []
+        for q_num, row in zip(self.questions, self.bboxes.tolist()):
+            bubbles = []
+            for choice, (x1, y1, x2, y2) in zip(self.choices, row):
+                bubbles.append({
+                    'choice': choice,
+                    'center': ((x1 + x2) // 2, (y1 + y2) // 2),
+                    'bbox': (x1, y1, x2, y2),
+                })
+            positions.append({'question': q_num, 'bubbles': bubbles})
+        return positions
+
+
+class TemplateStore:
+    """Armazém de gabaritos compartilhado entre workers via arquivos em `templates/`.
+
+    Contrato:
+    - publish(): grava os arrays de forma atômica (arquivo temporário + os.replace),
+      então um worker nunca enxerga um arquivo pela metade
+    - get(): devolve um TemplateEntry; guarda até `max_entries` gabaritos por processo (LRU)
+      e republica se o JSON de origem mudou desde a publicação
+    - erro: FileNotFoundError se o gabarito não existir em nenhum formato
+
+    Estatísticas (por processo):
+    - local_hits: gabarito já carregado neste processo
+    - shared_hits: arrays publicados por outro worker, só foi preciso ler
+    - misses: só havia o JSON (antigo ou alterado); os arrays foram (re)construídos e publicados
+    """
+
+    def __init__(self, root: str = TEMPLATES_DIR, max_entries: int = MAX_CACHED_TEMPLATES):
+        self.root = root
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, TemplateEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"local_hits": 0, "shared_hits": 0, "misses": 0}
+
+    def _path(self, template_id: str, suffix: str) -> str:
+        return os.path.join(self.root, f"{template_id}{suffix}")
+
+    @staticmethod
+    def _atomic_save(path: str, array: np.ndarray):
+        tmp_path = unique_tmp_path(path)
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+    def _remember(self, entry: TemplateEntry):
+        with self._lock:
+            self._entries[entry.template_id] = entry
+            self._entries.move_to_end(entry.template_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def publish(self, template_id: str, position_data, png_path: str | None = None,
+                positions_path: str | None = None) -> TemplateEntry:
+        """Grava os arrays compartilhados de um gabarito e o carrega neste processo.
+
+        `positions_path` é o JSON de origem; o mtime/tamanho dele fica no layout
+        para que get() perceba quando o mapa for alterado.
+        """
+        os.makedirs(self.root, exist_ok=True)
+
+        if png_path and os.path.exists(png_path):
+            layer = cv2.imread(png_path, cv2.IMREAD_GRAYSCALE)
+            if layer is not None:
+                self._atomic_save(self._path(template_id, "_layer.npy"), layer)
+
+        layout = {
+            "choices": list(position_data.get("choices", ("A", "B", "C", "D", "E"))),
+            "questions": question_numbers_from_position_data(position_data),
+            "page_size": list(position_data.get("page_size", ())),
+            "source": source_stamp(positions_path),
+        }
+        tmp_layout = unique_tmp_path(self._path(template_id, "_layout.json"))
+        with open(tmp_layout, "w") as f:
+            json.dump(layout, f)
+        os.replace(tmp_layout, self._path(template_id, "_layout.json"))
+
+        # Os bboxes são gravados por último: a presença deles marca o gabarito como publicado
+        self._atomic_save(self._path(template_id, "_bboxes.npy"), bboxes_from_position_data(position_data))
+
+        entry = self._load(template_id)
+        self._remember(entry)
+        return entry
+
+    def _load(self, template_id: str) -> TemplateEntry:
+        # Poucos KB: leitura comum, sem mmap (um mmap mantém um descritor aberto por array)
+        bboxes = np.load(self._path(template_id, "_bboxes.npy"))
+
+        with open(self._path(template_id, "_layout.json"), "r") as f:
+            layout = json.load(f)
+
+        return TemplateEntry(
+            template_id=template_id,
+            bboxes=bboxes,
+            questions=tuple(layout.get("questions", range(1, len(bboxes) + 1))),
+            choices=tuple(layout["choices"]),
+            page_size=tuple(layout["page_size"]),
+            layer_path=self._path(template_id, "_layer.npy"),
+            source=layout.get("source"),
+        )
+
+    def get(self, template_id: str, positions_path: str | None = None) -> TemplateEntry:
+        """Devolve o gabarito carregado; publica os arrays a partir do JSON se preciso."""
+        if positions_path is None:
+            positions_path = self._path(template_id, POSITIONS_SUFFIX)
+        # Um stat por chamada: é o que garante que um mapa editado não fica sombreado
+        stamp = source_stamp(positions_path)
+
+        def is_current(entry):
+            return stamp is None or entry.source == stamp
+
+        with self._lock:
+            entry = self._entries.get(template_id)
+            if entry is not None and is_current(entry):
+                self._entries.move_to_end(template_id)
+                self.stats["local_hits"] += 1
+                return entry
+
+        if os.path.exists(self._path(template_id, "_bboxes.npy")):
+            entry = self._load(template_id)
+            if is_current(entry):
+                self._remember(entry)
+                with self._lock:
+                    self.stats["shared_hits"] += 1
+                return entry
+
+        # Gabarito antigo (só JSON) ou JSON alterado: (re)constrói os arrays para todos os workers
+        with open(positions_path, "r") as f:
+            position_data = json.load(f)
+
+        png_path = self._path(template_id, ".png")
+        entry = self.publish(template_id, position_data, png_path, positions_path)
+        with self._lock:
+            self.stats["misses"] += 1
+        return entry